@@ -31,7 +31,7 @@ class LoadParameters:
             langs_id["dataset_id"] == lang_dataset_id, "stopwords_id"
         ].iloc[0]
         if stopwords_lang_id:
-            stopwords_lang = set(stopwords[stopwords_lang_id])
+            stopwords_lang = frozenset(stopwords[stopwords_lang_id])
         else:
             stopwords_lang = None
         return stopwords_lang
@@ -42,7 +42,7 @@ class LoadParameters:
             langs_id["dataset_id"] == lang_dataset_id, "flagged_words_id"
         ].iloc[0]
         if flagged_words_lang_id:
-            flagged_words_lang = set(flagged_words[flagged_words_lang_id])
+            flagged_words_lang = frozenset(flagged_words[flagged_words_lang_id])
         else:
             flagged_words_lang = None
         return flagged_words_lang
@@ -532,25 +532,25 @@ class Filtering:
         return cond
 
     @staticmethod
-    def compute_stopwords_ratio(
+    def get_words_and_augmentation(
         document,
         sentencepiece_model_tok,
         strip_characters,
         cond_words_augmentation,
         words_augmentation_group_sizes,
         words_augmentation_join_char,
-        stopwords,
     ):
+        """Get the lower cased words of a document and their augmentation.
+        Computed once, they can be shared between the stopwords ratio
+        and the flagged words ratio."""
         words = ModifyingDocuments.get_words_from_document(
             document,
             sentencepiece_model_tok,
             lower_case=True,
             strip_characters=strip_characters,
         )
-        if not words:
-            return 0
         augmentation = []
-        if cond_words_augmentation:
+        if words and cond_words_augmentation:
             augmentation = [
                 ModifyingDocuments.words_augmentation(
                     words, group_size, words_augmentation_join_char
@@ -558,11 +558,38 @@ class Filtering:
                 for group_size in words_augmentation_group_sizes
             ]
             augmentation = [word for augm in augmentation for word in augm]
-        stopwords_ratio = len(
-            [word for word in words + augmentation if word in stopwords]
+        return words, augmentation
+
+    @staticmethod
+    def compute_words_ratio(words, augmentation, words_to_count):
+        if not words:
+            return 0
+        words_ratio = len(
+            [word for word in words + augmentation if word in words_to_count]
         ) / len(words)
-        if stopwords_ratio > 1.0:
-            stopwords_ratio = 1.0
+        if words_ratio > 1.0:
+            words_ratio = 1.0
+        return words_ratio
+
+    @staticmethod
+    def compute_stopwords_ratio(
+        document,
+        sentencepiece_model_tok,
+        strip_characters,
+        cond_words_augmentation,
+        words_augmentation_group_sizes,
+        words_augmentation_join_char,
+        stopwords,
+    ):
+        words, augmentation = Filtering.get_words_and_augmentation(
+            document,
+            sentencepiece_model_tok,
+            strip_characters,
+            cond_words_augmentation,
+            words_augmentation_group_sizes,
+            words_augmentation_join_char,
+        )
+        stopwords_ratio = Filtering.compute_words_ratio(words, augmentation, stopwords)
         return stopwords_ratio
 
     @staticmethod
@@ -600,28 +627,17 @@ class Filtering:
         words_augmentation_join_char,
         flagged_words,
     ):
-        words = ModifyingDocuments.get_words_from_document(
+        words, augmentation = Filtering.get_words_and_augmentation(
             document,
             sentencepiece_model_tok,
-            lower_case=True,
-            strip_characters=strip_characters,
+            strip_characters,
+            cond_words_augmentation,
+            words_augmentation_group_sizes,
+            words_augmentation_join_char,
+        )
+        flagged_words_ratio = Filtering.compute_words_ratio(
+            words, augmentation, flagged_words
         )
-        if not words:
-            return 0
-        augmentation = []
-        if cond_words_augmentation:
-            augmentation = [
-                ModifyingDocuments.words_augmentation(
-                    words, group_size, words_augmentation_join_char
-                )
-                for group_size in words_augmentation_group_sizes
-            ]
-            augmentation = [word for augm in augmentation for word in augm]
-        flagged_words_ratio = len(
-            [word for word in words + augmentation if word in flagged_words]
-        ) / len(words)
-        if flagged_words_ratio > 1.0:
-            flagged_words_ratio = 1.0
         return flagged_words_ratio
 
     @staticmethod
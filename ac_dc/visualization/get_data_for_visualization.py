@@ -161,8 +161,10 @@ class GetDataForVisualization:
 
         self.stats = stats
 
+        # One document per line, so that the visualization can read them lazily
         with open(self.path_save_stats, "w") as f:
-            json.dump(self.stats, f)
+            for stats_document in self.stats:
+                f.write(json.dumps(stats_document) + "\n")
 
 
 if __name__ == "__main__":
@@ -179,7 +181,7 @@ if __name__ == "__main__":
     path_fasttext_model = "ac_dc/lid.176.bin"
     path_sentencepiece_model = f"ac_dc/{lang_dataset_id}.sp.model"
     path_kenlm_model = f"ac_dc/{lang_dataset_id}.arpa.bin"
-    path_save_stats = f"ac_dc/visualization/{lang_dataset_id}_examples_with_stats.json"
+    path_save_stats = f"ac_dc/visualization/{lang_dataset_id}_examples_with_stats.jsonl"
 
     dataset = load_dataset(
         dataset_name,
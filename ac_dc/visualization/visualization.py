@@ -6,14 +6,17 @@ import os
 
 from io import StringIO
 import base64
+import hashlib
+import itertools
 import json
 import pandas as pd
-
-pd.options.mode.chained_assignment = None
-
 import numpy as np
 
+import matplotlib
+
+matplotlib.use("Agg")
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 
 import sys
 from pathlib import Path
@@ -26,6 +29,166 @@ sys.path.append(str(Path(sys.path[0]).parent.absolute().parent.absolute()))
 from filtering import LoadParameters, ModifyingDocuments, Filtering
 from languages_id import langs_id
 
+# orjson parses the data several times faster than the standard library,
+# but it is optional
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    json_loads = json.loads
+    json_dumps = json.dumps
+
+
+def _iter_docs(path_data):
+    """Iterate over the documents of the data, stored either as a JSON list
+    or as JSON lines. JSON lines are parsed lazily, one document at a time."""
+    with open(path_data, "rb") as json_file:
+        is_json_list = json_file.read(1) == b"["
+        json_file.seek(0)
+        if is_json_list:
+            yield from json_loads(json_file.read())
+        else:
+            for line in json_file:
+                if line.strip():
+                    yield json_loads(line)
+
+
+# Streamlit reruns the whole script on every widget interaction, so the data
+# and the models are memoized to only be loaded once.
+@st.cache_data(show_spinner=False)
+def _load_docs(path_data, num_docs, num_docs_for_words, max_len_text_display):
+    # Only the documents that are kept are read, and their words and long
+    # texts are dropped as soon as they are read. The words are gathered
+    # by column, to build their DataFrame without converting each row.
+    words = {}
+    docs = []
+    num_examples = 0
+    for doc in itertools.islice(
+        _iter_docs(path_data), max(num_docs, num_docs_for_words)
+    ):
+        if num_examples == 0:
+            with_words = "words" in doc
+        if with_words:
+            doc_words = doc.pop("words")
+            if num_examples < num_docs_for_words:
+                for word in doc_words:
+                    for key, value in word.items():
+                        words.setdefault(key, []).append(value)
+        if num_examples < num_docs:
+            if len(doc["text"]) > max_len_text_display:
+                doc["text"] = (
+                    doc["text"][:max_len_text_display]
+                    + " [...] [THIS LONG TEXT HAS BEEN TRUNCATED FOR DISPLAY REASONS]"
+                )
+            docs.append(doc)
+        num_examples += 1
+
+    if with_words:
+        if "len_word" in words:
+            words["len_word"] = pd.to_numeric(
+                np.asarray(words["len_word"]), downcast="integer"
+            )
+        words = pd.DataFrame(words)
+    else:
+        words = None
+    docs = pd.DataFrame(docs)
+
+    # The statistics are downcast, the cutoffs are evaluated in float32 anyway
+    for key in docs.select_dtypes(include="integer"):
+        docs[key] = pd.to_numeric(docs[key], downcast="integer")
+    for key in docs.select_dtypes(include="floating"):
+        docs[key] = docs[key].astype(np.float32)
+
+    # The repetition ratios are stored as a dict {repetitions length: ratio}
+    # per document, expand them once into a DataFrame with one column per length
+    repetition_ratios = {
+        key: pd.DataFrame(list(docs[key]), index=docs.index, dtype=np.float32)
+        for key in ["character_repetition_ratio", "word_repetition_ratio"]
+        if key in docs
+    }
+    return words, docs, repetition_ratios, num_examples
+
+
+# The texts are identified by the arguments used to load them, and the
+# tokenization parameters by the language, so the unhashable arguments
+# (prefixed with an underscore) are left out of the cache key.
+@st.cache_data(show_spinner="Recomputing the ratio...")
+def _compute_words_ratios(
+    path_data,
+    num_docs,
+    max_len_text_display,
+    lang_dataset_id,
+    words_to_count,
+    _texts,
+    _sentencepiece_model_tok,
+    _param,
+):
+    return np.array(
+        [
+            Filtering.compute_words_ratio(
+                *Filtering.get_words_and_augmentation(
+                    text,
+                    _sentencepiece_model_tok,
+                    _param["strip_characters"],
+                    _param["cond_words_augmentation"],
+                    _param["words_augmentation_group_sizes"],
+                    _param["words_augmentation_join_char"],
+                ),
+                words_to_count,
+            )
+            for text in _texts
+        ],
+        dtype=np.float32,
+    )
+
+
+@st.cache_data(show_spinner=False, max_entries=100)
+def _compute_hist(key_name, values_digest, num_bins, _val):
+    # The range is only given to trim the outliers, np.histogram uses uniform
+    # bins for an integer number of bins with or without it
+    range_hist = None
+    if len(_val):
+        range_hist = (_val.min(), _val.max())
+        median = np.median(_val)
+        if median != 0:
+            # Outliers are left out of the histogram through its range
+            # instead of copying the values that are kept
+            mad = np.median(np.absolute(_val - median))
+            range_hist = (
+                max(range_hist[0], median - 9 * mad),
+                min(range_hist[1], median + 9 * mad),
+            )
+    return np.histogram(_val, bins=num_bins, range=range_hist, density=True)
+
+
+@st.cache_data(show_spinner=False)
+def _read_bytes(path):
+    return Path(path).read_bytes()
+
+
+@st.cache_data(show_spinner=False)
+def _read_base64(path):
+    return base64.b64encode(_read_bytes(path)).decode()
+
+
+@st.cache_resource(show_spinner=False)
+def _load_model_lang_id(lang_dataset_id, path_fasttext_model):
+    return LoadParameters.load_model_lang_id(lang_dataset_id, path_fasttext_model)
+
+
+@st.cache_resource(show_spinner=False)
+def _load_sentencepiece_model(lang_dataset_id, path_sentencepiece_model):
+    return LoadParameters.load_sentencepiece_model(
+        lang_dataset_id, path_sentencepiece_model
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def _load_kenlm_model(lang_dataset_id, path_kenlm_model):
+    return LoadParameters.load_kenlm_model(lang_dataset_id, path_kenlm_model)
+
 
 class Visualization_for_lang:
     def __init__(
@@ -40,6 +203,12 @@ class Visualization_for_lang:
         path_sentencepiece_model,
         path_kenlm_model,
     ):
+        # Statistics written as a JSON list by older versions of
+        # get_data_for_visualization.py are stored in a .json file
+        if path_data.endswith(".jsonl") and not os.path.exists(path_data):
+            legacy_path_data = path_data[: -len(".jsonl")] + ".json"
+            if os.path.exists(legacy_path_data):
+                path_data = legacy_path_data
         self.path_data = path_data
         self.lang = lang
         self.num_docs = num_docs
@@ -48,76 +217,127 @@ class Visualization_for_lang:
 
         self.lang_dataset_id = lang_dataset_id
         self.param = LoadParameters.load_parameters(lang_dataset_id)
+        # Parameters used to compute the statistics of a document
+        self.strip_characters = self.param["strip_characters"]
+        self.special_characters = self.param["special_characters"]
+        self.cond_words_augmentation = self.param["cond_words_augmentation"]
+        self.words_augmentation_group_sizes = self.param[
+            "words_augmentation_group_sizes"
+        ]
+        self.words_augmentation_join_char = self.param["words_augmentation_join_char"]
         self.stopwords = LoadParameters.load_stopwords(lang_dataset_id)
         self.flagged_words = LoadParameters.load_flagged_words(lang_dataset_id)
-        self.model_lang_id = LoadParameters.load_model_lang_id(
-            lang_dataset_id, path_fasttext_model
-        )
-        self.sentencepiece_model = LoadParameters.load_sentencepiece_model(
+        self.model_lang_id = _load_model_lang_id(lang_dataset_id, path_fasttext_model)
+        self.sentencepiece_model = _load_sentencepiece_model(
             lang_dataset_id, path_sentencepiece_model
         )
         self.sentencepiece_model_tok = (
             self.sentencepiece_model if self.param["tokenization"] else None
         )
-        self.kenlm_model = LoadParameters.load_kenlm_model(
-            lang_dataset_id, path_kenlm_model
-        )
+        self.kenlm_model = _load_kenlm_model(lang_dataset_id, path_kenlm_model)
 
     def set_title(self):
         st.title(f"Filtering visualization for {self.lang}")
 
     def open_data(self):
-        with open(self.path_data) as json_file:
-            data = json.load(json_file)
-
-        self.num_docs = min(self.num_docs, len(data))
-        self.num_docs_for_words = min(self.num_docs_for_words, len(data))
-
-        if "words" in data[0]:
-            words = [doc["words"] for doc in data[: self.num_docs_for_words]]
-            words = [word for doc in words for word in doc]
-            self.words = pd.DataFrame(words)
-        else:
-            self.words = None
+        (
+            self.words,
+            self.docs_checkpoint,
+            self.repetition_ratios,
+            num_examples,
+        ) = _load_docs(
+            self.path_data,
+            self.num_docs,
+            self.num_docs_for_words,
+            self.max_len_text_display,
+        )
 
-        docs = data[: self.num_docs]
-        for doc in docs:
-            if not (self.words is None):
-                del doc["words"]
-            if len(doc["text"]) > self.max_len_text_display:
-                doc["text"] = (
-                    doc["text"][: self.max_len_text_display]
-                    + " [...] [THIS LONG TEXT HAS BEEN TRUNCATED FOR DISPLAY REASONS]"
-                )
-        self.docs_checkpoint = pd.DataFrame(docs)
-        self.docs = self.docs_checkpoint
+        self.num_docs = min(self.num_docs, num_examples)
+        self.num_docs_for_words = min(self.num_docs_for_words, num_examples)
+
+        self.docs = self.docs_checkpoint.copy(deep=False)
+
+        # The statistics on which the documents are filtered are gathered in a
+        # float32 matrix stored column by column, so that the cutoff of each
+        # filter is evaluated with NumPy on a contiguous array.
+        # The repetition ratios are filled in once the repetitions length is chosen.
+        feature_cols = [
+            key
+            for key in [
+                "number_words",
+                "character_repetition_ratio",
+                "word_repetition_ratio",
+                "special_characters_ratio",
+                "stopwords_ratio",
+                "flagged_words_ratio",
+                "lang_id_score",
+                "perplexity_score",
+            ]
+            if key in self.docs_checkpoint
+        ]
+        self.feat_idx = {key: i for i, key in enumerate(feature_cols)}
+        self.feat_mat = np.zeros(
+            (len(self.docs_checkpoint), len(feature_cols)), dtype=np.float32, order="F"
+        )
+        for key, i in self.feat_idx.items():
+            if key not in self.repetition_ratios:
+                self.feat_mat[:, i] = self.docs_checkpoint[key]
+
+    def get_feature(self, key):
+        return self.feat_mat[:, self.feat_idx[key]]
+
+    def set_feature(self, key, values):
+        self.docs[key] = values
+        self.feat_mat[:, self.feat_idx[key]] = self.docs[key]
+
+    def compute_words_ratios(self, words_to_count):
+        """Ratios of the given words for all the loaded documents,
+        cached as long as the list of words does not change."""
+        return _compute_words_ratios(
+            self.path_data,
+            self.num_docs,
+            self.max_len_text_display,
+            self.lang_dataset_id,
+            words_to_count,
+            self.docs_checkpoint["text"],
+            self.sentencepiece_model_tok,
+            self.param,
+        )
 
     @staticmethod
     def print_discarded_by_cond(cond):
+        cond = np.asarray(cond)
         st.caption(
-            f"{(len(cond) - np.sum(1*cond)) / len(cond) * 100:.2f}% of the total is discarded with this filter."
+            f"{(cond.size - cond.sum()) / cond.size * 100:.2f}% of the total is discarded with this filter."
         )
 
     @staticmethod
-    def plot_hist(dataframe, key, num_bins=50):
+    def plot_hist(val, key, num_bins=50):
         checkbox = st.checkbox(
             "Diplay distribution", value=True, key=f"display_distribution_{key[0]}"
         )
         if checkbox:
-            fig, ax = plt.subplots()
-            val = dataframe[key[0]].values
-            if np.median(val) != 0:
-                val = val[
-                    abs(val - np.median(val))
-                    < 9 * np.median(np.absolute(val - np.median(val)))
-                ]
-            ax.hist(val, bins=num_bins, density=True)
+            # Creating a figure is slow, so each distribution reuses its own
+            # figure across the reruns of the session
+            figure_key = f"figure_distribution_{key[0]}"
+            if figure_key not in st.session_state:
+                figure = Figure()
+                st.session_state[figure_key] = (figure, figure.subplots())
+            fig, ax = st.session_state[figure_key]
+            ax.clear()
+            # The distribution only changes with the documents, not with the
+            # cutoff, so the histogram is cached on a digest of the values
+            digest = hashlib.blake2b(val.tobytes(), digest_size=16).hexdigest()
+            hist, bin_edges = _compute_hist(key[0], digest, num_bins, val)
+            ax.bar(bin_edges[:-1], hist, width=np.diff(bin_edges), align="edge")
             ax.set_title(" ".join(key[0].split("_")))
             ax.axvline(x=key[1], color="r", linestyle="dashed")
             st.pyplot(fig)
 
     @staticmethod
-    def display_dataset(dataframe, cond, description, type_of_examples):
+    def display_dataset(
+        dataframe, cond, description, type_of_examples, max_displayed_examples=500
+    ):
         displayed_examples = dataframe.loc[cond]
         st.subheader(
             f"{description}: {len(displayed_examples)} {type_of_examples} ({len(displayed_examples) / len(dataframe.index) * 100:.2f}%)"
@@ -125,31 +345,51 @@ class Visualization_for_lang:
         st.markdown(
             "Click on a column to sort by it, place the cursor on the text to display it."
         )
-        st.dataframe(displayed_examples)
+        # The whole table is sent to the browser on every rerun,
+        # so only its first rows are displayed
+        if len(displayed_examples) > max_displayed_examples:
+            st.caption(
+                f"Only the first {max_displayed_examples} {type_of_examples} are displayed, download them all below."
+            )
+        st.dataframe(displayed_examples.head(max_displayed_examples), height=400)
+        # The CSV is only generated when the button is clicked
+        st.download_button(
+            label=f"Download the {len(displayed_examples)} {type_of_examples} as csv",
+            data=lambda: displayed_examples.to_csv(index=False),
+            file_name=f"{description.lower().replace(' ', '_')}.csv",
+            mime="text/csv",
+            key=f"download_{description}",
+            on_click="ignore",
+        )
 
     def filtering_of_docs(self):
+        def get_cond(key, cutoff, max_cutoff):
+            if max_cutoff:
+                return self.get_feature(key) <= cutoff
+            return self.get_feature(key) >= cutoff
+
         def set_sliders():
             columns = list(self.docs)
             keys = []
-            conds = {}
-
-            def get_cond(key, cutoff, max_cutoff):
-                if max_cutoff:
-                    return self.docs[key] <= cutoff
-                return self.docs[key] >= cutoff
+            # The documents kept by all the filters, updated with the
+            # condition of each filter as soon as it is computed
+            all_conds = np.ones(len(self.docs), dtype=bool)
 
             if "number_words" in columns:
                 with st.sidebar.expander("Number of words"):
                     cutoff_def = "If the number of words of a document is lower than this number, the document is removed."
-                    max_nb_words = int(np.max(self.docs["number_words"])) + 1
+                    max_nb_words = int(np.max(self.get_feature("number_words"))) + 1
                     cutoff_min_number_words = st.slider(
                         cutoff_def, 0, min(max_nb_words, 500), 0
                     )
                     new_key = ("number_words", cutoff_min_number_words, False)
                     keys.append(new_key)
-                    Visualization_for_lang.plot_hist(self.docs, new_key)
+                    Visualization_for_lang.plot_hist(
+                        self.get_feature(new_key[0]), new_key
+                    )
                     cond_1 = get_cond(new_key[0], new_key[1], new_key[2])
                     Visualization_for_lang.print_discarded_by_cond(cond_1)
+                    all_conds &= cond_1
 
                     cutoff_def = "If the number of words of a document is higher than this number, the document is removed."
                     cutoff_max_number_words = st.slider(
@@ -159,13 +399,12 @@ class Visualization_for_lang:
                     keys.append(new_key)
                     cond_2 = get_cond(new_key[0], new_key[1], new_key[2])
                     Visualization_for_lang.print_discarded_by_cond(cond_2)
-
-                    conds["number_words"] = [cond_1, cond_2]
+                    all_conds &= cond_2
 
             if "character_repetition_ratio" in columns:
                 with st.sidebar.expander("Character repetition ratio"):
                     val_repetitions_lengths = list(
-                        self.docs["character_repetition_ratio"].iloc[0].keys()
+                        self.repetition_ratios["character_repetition_ratio"].columns
                     )
                     default_index = (
                         val_repetitions_lengths.index("10")
@@ -187,13 +426,12 @@ class Visualization_for_lang:
                         "positives are very short documents (which we want to delete anyway) rather than long ones. However, "
                         "a low number can be useful for Chinese, where a character can designate a whole word."
                     )
-                    self.docs["character_repetition_ratio"] = self.docs_checkpoint[
-                        "character_repetition_ratio"
-                    ]
-                    for i in range(len(self.docs["character_repetition_ratio"])):
-                        self.docs["character_repetition_ratio"].iloc[i] = self.docs[
-                            "character_repetition_ratio"
-                        ].iloc[i][repetitions_length]
+                    self.set_feature(
+                        "character_repetition_ratio",
+                        self.repetition_ratios["character_repetition_ratio"][
+                            repetitions_length
+                        ],
+                    )
 
                     cutoff_def = "If the character repetition ratio of a document is higher than this number, the document is removed."
                     cutoff_character_repetition_ratio = st.slider(
@@ -206,15 +444,17 @@ class Visualization_for_lang:
                         repetitions_length,
                     )
                     keys.append(new_key)
-                    Visualization_for_lang.plot_hist(self.docs, new_key)
+                    Visualization_for_lang.plot_hist(
+                        self.get_feature(new_key[0]), new_key
+                    )
                     cond = get_cond(new_key[0], new_key[1], new_key[2])
                     Visualization_for_lang.print_discarded_by_cond(cond)
-                    conds["character_repetition_ratio"] = [cond]
+                    all_conds &= cond
 
             if "word_repetition_ratio" in columns:
                 with st.sidebar.expander("Word repetition ratio"):
                     val_repetitions_lengths = list(
-                        self.docs["word_repetition_ratio"].iloc[0].keys()
+                        self.repetition_ratios["word_repetition_ratio"].columns
                     )
                     default_index = (
                         val_repetitions_lengths.index("5")
@@ -235,13 +475,12 @@ class Visualization_for_lang:
                         "not want to discard such documents. It is generally better to increase a bit this number, so that false "
                         "positives are very short documents (which we want to delete anyway) rather than long ones."
                     )
-                    self.docs["word_repetition_ratio"] = self.docs_checkpoint[
-                        "word_repetition_ratio"
-                    ]
-                    for i in range(len(self.docs["word_repetition_ratio"])):
-                        self.docs["word_repetition_ratio"].iloc[i] = self.docs[
-                            "word_repetition_ratio"
-                        ].iloc[i][repetitions_length]
+                    self.set_feature(
+                        "word_repetition_ratio",
+                        self.repetition_ratios["word_repetition_ratio"][
+                            repetitions_length
+                        ],
+                    )
 
                     cutoff_def = "If the word repetition ratio of a document is higher than this number, the document is removed."
                     cutoff_word_repetition_ratio = st.slider(
@@ -254,10 +493,12 @@ class Visualization_for_lang:
                         repetitions_length,
                     )
                     keys.append(new_key)
-                    Visualization_for_lang.plot_hist(self.docs, new_key)
+                    Visualization_for_lang.plot_hist(
+                        self.get_feature(new_key[0]), new_key
+                    )
                     cond = get_cond(new_key[0], new_key[1], new_key[2])
                     Visualization_for_lang.print_discarded_by_cond(cond)
-                    conds["word_repetition_ratio"] = [cond]
+                    all_conds &= cond
 
             if "special_characters_ratio" in columns:
                 with st.sidebar.expander("Special characters ratio"):
@@ -271,10 +512,12 @@ class Visualization_for_lang:
                         True,
                     )
                     keys.append(new_key)
-                    Visualization_for_lang.plot_hist(self.docs, new_key)
+                    Visualization_for_lang.plot_hist(
+                        self.get_feature(new_key[0]), new_key
+                    )
                     cond = get_cond(new_key[0], new_key[1], new_key[2])
                     Visualization_for_lang.print_discarded_by_cond(cond)
-                    conds["special_characters_ratio"] = [cond]
+                    all_conds &= cond
 
             if "stopwords_ratio" in columns:
                 with st.sidebar.expander("Stop words ratio"):
@@ -285,32 +528,23 @@ class Visualization_for_lang:
                         new_stopwords = StringIO(
                             stopwords_file.getvalue().decode("utf-8")
                         ).read()
-                        new_stopwords = set(new_stopwords.split("\n"))
-                        self.docs["stopwords_ratio"] = self.docs_checkpoint[
-                            "stopwords_ratio"
-                        ]
-                        for i in range(len(self.docs["stopwords_ratio"])):
-                            self.docs["stopwords_ratio"].iloc[
-                                i
-                            ] = Filtering.compute_stopwords_ratio(
-                                self.docs["text"].iloc[i],
-                                self.sentencepiece_model_tok,
-                                self.param["strip_characters"],
-                                self.param["cond_words_augmentation"],
-                                self.param["words_augmentation_group_sizes"],
-                                self.param["words_augmentation_join_char"],
-                                new_stopwords,
-                            )
+                        new_stopwords = frozenset(new_stopwords.split("\n"))
+                        self.set_feature(
+                            "stopwords_ratio",
+                            self.compute_words_ratios(new_stopwords)[self.docs.index],
+                        )
                     cutoff_def = "If the stop words ratio of a document is lower than this number, the document is removed."
                     cutoff_stopwords_ratio = st.slider(
                         cutoff_def, 0.0, 1.0, 0.0, step=0.01
                     )
                     new_key = ("stopwords_ratio", cutoff_stopwords_ratio, False)
                     keys.append(new_key)
-                    Visualization_for_lang.plot_hist(self.docs, new_key)
+                    Visualization_for_lang.plot_hist(
+                        self.get_feature(new_key[0]), new_key
+                    )
                     cond = get_cond(new_key[0], new_key[1], new_key[2])
                     Visualization_for_lang.print_discarded_by_cond(cond)
-                    conds["stopwords_ratio"] = [cond]
+                    all_conds &= cond
 
             if "flagged_words_ratio" in columns:
                 with st.sidebar.expander("Flagged words ratio"):
@@ -321,26 +555,16 @@ class Visualization_for_lang:
                         new_flagged_words = StringIO(
                             flagged_words_file.getvalue().decode("utf-8")
                         ).read()
-                        new_flagged_words = set(new_flagged_words.split("\n"))
-                        self.docs["flagged_words_ratio"] = self.docs_checkpoint[
-                            "flagged_words_ratio"
-                        ]
-                        for i in range(len(self.docs["flagged_words_ratio"])):
-                            self.docs["flagged_words_ratio"].iloc[
-                                i
-                            ] = Filtering.compute_flagged_words_ratio(
-                                self.docs["text"].iloc[i],
-                                self.sentencepiece_model_tok,
-                                self.param["strip_characters"],
-                                self.param["cond_words_augmentation"],
-                                self.param["words_augmentation_group_sizes"],
-                                self.param["words_augmentation_join_char"],
-                                new_flagged_words,
-                            )
+                        new_flagged_words = frozenset(new_flagged_words.split("\n"))
+                        self.set_feature(
+                            "flagged_words_ratio",
+                            self.compute_words_ratios(new_flagged_words)[
+                                self.docs.index
+                            ],
+                        )
                     cutoff_def = "If the flagged words ratio of a document is higher than this number, the document is removed."
-                    max_fwr = np.max(self.docs["flagged_words_ratio"])
-                    max_fwr = np.ceil(max_fwr * 1000) / 1000
-                    max_fwr = float(max_fwr)
+                    max_fwr = np.max(self.get_feature("flagged_words_ratio"))
+                    max_fwr = float(np.ceil(max_fwr * 1000)) / 1000
                     cutoff_flagged_words_ratio = st.slider(
                         cutoff_def,
                         0.000,
@@ -351,10 +575,12 @@ class Visualization_for_lang:
                     )
                     new_key = ("flagged_words_ratio", cutoff_flagged_words_ratio, True)
                     keys.append(new_key)
-                    Visualization_for_lang.plot_hist(self.docs, new_key)
+                    Visualization_for_lang.plot_hist(
+                        self.get_feature(new_key[0]), new_key
+                    )
                     cond = get_cond(new_key[0], new_key[1], new_key[2])
                     Visualization_for_lang.print_discarded_by_cond(cond)
-                    conds["flagged_words_ratio"] = [cond]
+                    all_conds &= cond
 
             if "lang_id_score" in columns:
                 with st.sidebar.expander("Language ID confidence score"):
@@ -364,24 +590,28 @@ class Visualization_for_lang:
                     )
                     new_key = ("lang_id_score", cutoff_lang_id_score, False)
                     keys.append(new_key)
-                    Visualization_for_lang.plot_hist(self.docs, new_key)
+                    Visualization_for_lang.plot_hist(
+                        self.get_feature(new_key[0]), new_key
+                    )
                     cond = get_cond(new_key[0], new_key[1], new_key[2])
                     Visualization_for_lang.print_discarded_by_cond(cond)
-                    conds["lang_id_score"] = [cond]
+                    all_conds &= cond
 
             if "perplexity_score" in columns:
                 with st.sidebar.expander("Perplexity score"):
                     cutoff_def = "If the perplexity score of a document is higher than this number, the document is removed."
-                    max_pp = int(np.max(self.docs["perplexity_score"])) + 1
+                    max_pp = int(np.max(self.get_feature("perplexity_score"))) + 1
                     cutoff_perplexity_score = st.slider(cutoff_def, 0, max_pp, max_pp)
                     new_key = ("perplexity_score", cutoff_perplexity_score, True)
                     keys.append(new_key)
-                    Visualization_for_lang.plot_hist(self.docs, new_key)
+                    Visualization_for_lang.plot_hist(
+                        self.get_feature(new_key[0]), new_key
+                    )
                     cond = get_cond(new_key[0], new_key[1], new_key[2])
                     Visualization_for_lang.print_discarded_by_cond(cond)
-                    conds["perplexity_score"] = [cond]
+                    all_conds &= cond
 
-            return keys, conds
+            return keys, all_conds
 
         with st.expander(
             f"Filtering on documents, for {self.num_docs} {self.lang} documents"
@@ -407,12 +637,13 @@ class Visualization_for_lang:
                 )
                 chosen_label = chosen_label.split(":")[0]
                 if chosen_label != "All":
-                    cond_label = list(
-                        self.docs["labels"].apply(
-                            lambda x: True if chosen_label in x else False
-                        )
+                    cond_label = np.fromiter(
+                        (chosen_label in labels for labels in self.docs["labels"]),
+                        dtype=bool,
+                        count=len(self.docs),
                     )
                     self.docs = self.docs[cond_label]
+                    self.feat_mat = np.asfortranarray(self.feat_mat[cond_label])
 
             if self.docs.empty:
                 st.markdown(
@@ -423,14 +654,9 @@ class Visualization_for_lang:
 
             else:
                 st.sidebar.subheader("Parameters of the filtering on documents")
-                self.keys, conds = set_sliders()
+                self.keys, all_conds = set_sliders()
                 self.parameters = self.keys * 1
 
-                all_conds = [
-                    subcond for cond in list(conds.values()) for subcond in cond
-                ]
-                all_conds = np.all(all_conds, axis=0)
-
                 Visualization_for_lang.display_dataset(
                     self.docs, np.invert(all_conds), "Discarded documents", "docs"
                 )
@@ -443,8 +669,17 @@ class Visualization_for_lang:
                 if display_discarded_documents_by_filter:
                     columns = list(self.docs)
 
+                    # The conditions of each filter are only evaluated again
+                    # when the documents they discard are displayed
+                    def get_cond_filter(key_name):
+                        cond = np.ones(len(self.docs), dtype=bool)
+                        for key in self.keys:
+                            if key[0] == key_name:
+                                cond &= get_cond(key[0], key[1], key[2])
+                        return np.invert(cond)
+
                     if "number_words" in columns:
-                        cond_filter = np.invert(np.all(conds["number_words"], axis=0))
+                        cond_filter = get_cond_filter("number_words")
                         Visualization_for_lang.display_dataset(
                             self.docs,
                             cond_filter,
@@ -453,9 +688,7 @@ class Visualization_for_lang:
                         )
 
                     if "character_repetition_ratio" in columns:
-                        cond_filter = np.invert(
-                            np.all(conds["character_repetition_ratio"], axis=0)
-                        )
+                        cond_filter = get_cond_filter("character_repetition_ratio")
                         Visualization_for_lang.display_dataset(
                             self.docs,
                             cond_filter,
@@ -464,9 +697,7 @@ class Visualization_for_lang:
                         )
 
                     if "word_repetition_ratio" in columns:
-                        cond_filter = np.invert(
-                            np.all(conds["word_repetition_ratio"], axis=0)
-                        )
+                        cond_filter = get_cond_filter("word_repetition_ratio")
                         Visualization_for_lang.display_dataset(
                             self.docs,
                             cond_filter,
@@ -475,9 +706,7 @@ class Visualization_for_lang:
                         )
 
                     if "special_characters_ratio" in columns:
-                        cond_filter = np.invert(
-                            np.all(conds["special_characters_ratio"], axis=0)
-                        )
+                        cond_filter = get_cond_filter("special_characters_ratio")
                         Visualization_for_lang.display_dataset(
                             self.docs,
                             cond_filter,
@@ -486,9 +715,7 @@ class Visualization_for_lang:
                         )
 
                     if "stopwords_ratio" in columns:
-                        cond_filter = np.invert(
-                            np.all(conds["stopwords_ratio"], axis=0)
-                        )
+                        cond_filter = get_cond_filter("stopwords_ratio")
                         Visualization_for_lang.display_dataset(
                             self.docs,
                             cond_filter,
@@ -497,9 +724,7 @@ class Visualization_for_lang:
                         )
 
                     if "flagged_words_ratio" in columns:
-                        cond_filter = np.invert(
-                            np.all(conds["flagged_words_ratio"], axis=0)
-                        )
+                        cond_filter = get_cond_filter("flagged_words_ratio")
                         Visualization_for_lang.display_dataset(
                             self.docs,
                             cond_filter,
@@ -508,7 +733,7 @@ class Visualization_for_lang:
                         )
 
                     if "lang_id_score" in columns:
-                        cond_filter = np.invert(np.all(conds["lang_id_score"], axis=0))
+                        cond_filter = get_cond_filter("lang_id_score")
                         Visualization_for_lang.display_dataset(
                             self.docs,
                             cond_filter,
@@ -517,9 +742,7 @@ class Visualization_for_lang:
                         )
 
                     if "perplexity_score" in columns:
-                        cond_filter = np.invert(
-                            np.all(conds["perplexity_score"], axis=0)
-                        )
+                        cond_filter = get_cond_filter("perplexity_score")
                         Visualization_for_lang.display_dataset(
                             self.docs,
                             cond_filter,
@@ -533,12 +756,12 @@ class Visualization_for_lang:
 
             st.header("Download data")
 
-            with open(self.path_data) as json_file:
-                btn = st.download_button(
-                    label="Download data as json",
-                    data=json_file,
-                    file_name="data.json",
-                )
+            btn = st.download_button(
+                label="Download data as json",
+                data=_read_bytes(self.path_data),
+                file_name=os.path.basename(self.path_data),
+                mime="application/json",
+            )
 
     def filtering_of_words(self):
         if not (self.words is None):
@@ -555,8 +778,10 @@ class Visualization_for_lang:
                     cutoff_word = st.slider(cutoff_def, 0, max_len_word, max_len_word)
                     new_key = ("len_word", cutoff_word, True)
                     self.parameters.append(new_key)
-                    Visualization_for_lang.plot_hist(self.words, new_key)
-                    cond_len_words = self.words["len_word"] <= cutoff_word
+                    Visualization_for_lang.plot_hist(
+                        self.words["len_word"].to_numpy(), new_key
+                    )
+                    cond_len_words = self.words["len_word"].to_numpy() <= cutoff_word
                     Visualization_for_lang.print_discarded_by_cond(cond_len_words)
                     conds_words["len_word"] = cond_len_words
 
@@ -587,21 +812,18 @@ class Visualization_for_lang:
 
                     if incorrect_substrings:
                         cond_incorrect_substrings = np.invert(
-                            self.words["incorrect_substrings"]
+                            self.words["incorrect_substrings"].to_numpy()
                         )
                     else:
-                        cond_incorrect_substrings = np.array(
-                            [
-                                True
-                                for i in range(len(self.words["incorrect_substrings"]))
-                            ]
-                        )
+                        cond_incorrect_substrings = np.ones(len(self.words), dtype=bool)
                     Visualization_for_lang.print_discarded_by_cond(
                         cond_incorrect_substrings
                     )
                     conds_words["incorrect_substrings"] = cond_incorrect_substrings
 
-            all_conds_words = np.all(list(conds_words.values()), axis=0)
+            all_conds_words = np.ones(len(self.words), dtype=bool)
+            for cond in conds_words.values():
+                all_conds_words &= cond
 
             with st.expander(
                 f"Filtering on words, for {self.num_docs_for_words} {self.lang} documents"
@@ -652,7 +874,7 @@ class Visualization_for_lang:
         st.sidebar.subheader("Download parameters")
         btn = st.sidebar.download_button(
             label="Download current parameters as json",
-            data=json.dumps(self.parameters),
+            data=json_dumps(self.parameters),
             file_name=f"parameters_{self.lang_dataset_id}.json",
         )
 
@@ -665,11 +887,7 @@ class Visualization_for_lang:
 
             if display_zipf_law:
 
-                freq_words = {}
-                for _, row in self.words.iterrows():
-                    freq_words[row["word"]] = freq_words.get(row["word"], 0) + 1
-                freq_words = np.array(list(freq_words.values()))
-                freq_words = -np.sort(-freq_words)
+                freq_words = self.words["word"].value_counts().to_numpy()
 
                 fig, ax = plt.subplots()
                 ax.loglog(freq_words)
@@ -701,13 +919,30 @@ class Visualization_for_lang:
 
                 st.markdown("Statistics of the document:")
 
+                # The stopwords and the flagged words ratios are computed
+                # on the same words, tokenize the document only once for both
+                if {"stopwords_ratio", "flagged_words_ratio"} & {
+                    key[0] for key in self.keys
+                }:
+                    (
+                        words_lower_case,
+                        augmentation,
+                    ) = Filtering.get_words_and_augmentation(
+                        personal_doc,
+                        self.sentencepiece_model_tok,
+                        self.strip_characters,
+                        self.cond_words_augmentation,
+                        self.words_augmentation_group_sizes,
+                        self.words_augmentation_join_char,
+                    )
+
                 for key in self.keys:
                     if key[0] == "number_words":
                         words = ModifyingDocuments.get_words_from_document(
                             personal_doc,
                             self.sentencepiece_model_tok,
                             lower_case=False,
-                            strip_characters=self.param["strip_characters"],
+                            strip_characters=self.strip_characters,
                         )
                         if key[2]:
                             st.markdown(f"Number of words: {len(words)}")
@@ -733,7 +968,7 @@ class Visualization_for_lang:
                         word_repetition_ratio = Filtering.compute_word_repetition_ratio(
                             personal_doc,
                             self.sentencepiece_model_tok,
-                            self.param["strip_characters"],
+                            self.strip_characters,
                             int(key[3]),
                         )
                         word_repetition_ratio = round(word_repetition_ratio, 3)
@@ -744,7 +979,7 @@ class Visualization_for_lang:
                     elif key[0] == "special_characters_ratio":
                         special_characters_ratio = (
                             Filtering.compute_special_characters_ratio(
-                                personal_doc, self.param["special_characters"]
+                                personal_doc, self.special_characters
                             )
                         )
                         special_characters_ratio = round(special_characters_ratio, 3)
@@ -755,14 +990,8 @@ class Visualization_for_lang:
                             is_discarded = True
 
                     elif key[0] == "stopwords_ratio":
-                        stopwords_ratio = Filtering.compute_stopwords_ratio(
-                            personal_doc,
-                            self.sentencepiece_model_tok,
-                            self.param["strip_characters"],
-                            self.param["cond_words_augmentation"],
-                            self.param["words_augmentation_group_sizes"],
-                            self.param["words_augmentation_join_char"],
-                            self.stopwords,
+                        stopwords_ratio = Filtering.compute_words_ratio(
+                            words_lower_case, augmentation, self.stopwords
                         )
                         stopwords_ratio = round(stopwords_ratio, 3)
                         st.markdown(f"Stop words ratio: {stopwords_ratio}")
@@ -770,14 +999,8 @@ class Visualization_for_lang:
                             is_discarded = True
 
                     elif key[0] == "flagged_words_ratio":
-                        flagged_words_ratio = Filtering.compute_flagged_words_ratio(
-                            personal_doc,
-                            self.sentencepiece_model_tok,
-                            self.param["strip_characters"],
-                            self.param["cond_words_augmentation"],
-                            self.param["words_augmentation_group_sizes"],
-                            self.param["words_augmentation_join_char"],
-                            self.flagged_words,
+                        flagged_words_ratio = Filtering.compute_words_ratio(
+                            words_lower_case, augmentation, self.flagged_words
                         )
                         flagged_words_ratio = round(flagged_words_ratio, 3)
                         st.markdown(f"Flagged words ratio: {flagged_words_ratio}")
@@ -832,9 +1055,7 @@ class Visualization:
 
     def preamble(self):
         def get_binary_file_downloader_html(bin_file, file_label="File"):
-            with open(bin_file, "rb") as f:
-                data = f.read()
-            bin_str = base64.b64encode(data).decode()
+            bin_str = _read_base64(bin_file)
             href = f'<a href="data:application/octet-stream;base64,{bin_str}" download="{os.path.basename(bin_file)}">{file_label}</a>'
             return href
 
@@ -907,7 +1128,7 @@ path_instructions = "./ac_dc/explanation_filtering_pipeline.pdf"
 
 param_visu_langs = {
     lang_dataset_id: {
-        "path_data": f"./ac_dc/visualization/{lang_dataset_id}_examples_with_stats.json",
+        "path_data": f"./ac_dc/visualization/{lang_dataset_id}_examples_with_stats.jsonl",
         "lang": langs_id.loc[langs_id["dataset_id"] == lang_dataset_id, "lang"].iloc[0],
         "num_docs": 15000,
         "num_docs_for_words": 1500,
@@ -1,24 +1,43 @@
 import re
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
 from datasets import load_dataset, concatenate_datasets
 
 
 def get_args():
     parser = ArgumentParser()
     parser.add_argument("--dataset", type=str, required=True, help="Dataset name")
+    parser.add_argument(
+        "--num-proc", type=int, default=1, help="Number of procs use for mapping."
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=10_000,
+        help="Batch size used for mapping the dataset.",
+    )
 
     args = parser.parse_args()
 
-    assert args.dataset not in args.datasets_to_concatenate
     matches = re.match(
-        r"^bigscience-catalogue-data/pseudo_crawl_(.*)(_dedup_url)?$", args.dataset
+        r"^bigscience-catalogue-data/pseudo_crawl_(.*?)(_dedup_url)?$", args.dataset
     )
     assert matches is not None
     flavor = matches.groups()[0]
     assert re.match(r"^intermediate_depth_([0-9]+)$", flavor) is not None
     args.flavor = flavor
 
+    # Remove duplicates while keeping the order, a duplicate would be loaded twice
+    args.datasets_to_concatenate = list(
+        dict.fromkeys(get_all_datasets_to_concatenate(flavor))
+    )
+    assert args.dataset not in set(args.datasets_to_concatenate)
+
     return args
 
 
@@ -51,60 +70,163 @@ def get_all_datasets_to_concatenate(flavor):
     return seed_datasets + intermediate_depth_datasets
 
 
-def compute_external_ids_(ds):
-    """This is done at the end of processing and we basically convert `external_urls` in `external_ids`"""
-    # For each url, find the most recent row id corresponding to that url
-    # All of the duplicate of a `url` are either all in that dictionary or not in that dictionary
-    # This table allows me to do a double join so I can easily compute the ids.
-    # We'll then go through that csv and add the ids to final dataset.
-    # No duplicates guaranteed
-    url_to_id_and_timestamp = {}
-    # TODO: batch this
-    for data in ds:
-        url = data["url"]
-        id_ = data["id"]
-        timestamp = data["fetch_time"]
-        if url in url_to_id_and_timestamp:
-            old_id, old_time_stamp = url_to_id_and_timestamp[url]
-            new_timestamp, new_id = max((timestamp, id_), (old_time_stamp, old_id))
-            url_to_id_and_timestamp[url] = (new_id, new_timestamp)
-        else:
-            url_to_id_and_timestamp[url] = (id_, timestamp)
+def get_latest_rows(table):
+    """Keep the most recent row of each url, the one with the highest id on ties.
+    After sorting by (fetch_time, id), it is the last row of the url.
+    The urls are grouped by Arrow, without ever being converted to Python strings."""
+    # The fetch times are compared as int64 nanoseconds, which also lets the latest
+    # rows of datasets storing timestamps with different units be merged
+    if pa.types.is_timestamp(table.schema.field("fetch_time").type):
+        fetch_time = table["fetch_time"].cast(pa.timestamp("ns")).cast(pa.int64())
+        table = table.set_column(
+            table.schema.get_field_index("fetch_time"), "fetch_time", fetch_time
+        )
+    table = table.sort_by([("fetch_time", "ascending"), ("id", "ascending")])
+    # Without threads, the rows of a group keep the order of the table
+    table = table.group_by("url", use_threads=False).aggregate(
+        [("id", "last"), ("fetch_time", "last")]
+    )
+    return table.select(["id_last", "fetch_time_last", "url"]).rename_columns(
+        ["id", "fetch_time", "url"]
+    )
 
-    # TODO: batch this
-    for data in ds:
-        # Not all urls are part of our index. We keep `external_urls` for this sake.
-        data["external_ids"] = [
-            url_to_id_and_timestamp[external_url][0]
-            for external_url in data["external_urls"]
-            if external_url in url_to_id_and_timestamp
-        ]
 
-    return ds
+def select_latest_rows(ds, num_proc=1, batch_size=10_000):
+    """For each url, find the most recent row of `ds`.
+    The most recent rows are first selected within each batch, in parallel, and
+    then among the rows selected in all the batches."""
+    rows = ds.select_columns(["url", "id", "fetch_time"]).with_format("arrow")
+    if num_proc > 1:
+        latest_rows = rows.map(
+            get_latest_rows,
+            batched=True,
+            batch_size=batch_size,
+            num_proc=num_proc,
+        )[:]
+    else:
+        # A single process reduces the batches as they are read, without writing
+        # the selected rows to a cache file
+        latest_rows = pa.concat_tables(
+            [get_latest_rows(batch) for batch in rows.iter(batch_size=batch_size)]
+        )
+    return get_latest_rows(latest_rows)
+
+
+def get_url_ids(latest_rows):
+    """Split the latest rows in the urls to look up and their ids.
+    Only the id is kept, the timestamp is just needed to pick that row."""
+    # All of the duplicate of a `url` are either all in that table or not in that table
+    # No duplicates guaranteed
+    # Large strings have 64-bit offsets, the urls can total more than 2GB
+    urls = latest_rows["url"].cast(pa.large_string()).combine_chunks()
+    ids = latest_rows["id"]
+    return urls, ids
 
 
-def assign_id(batch, indices):
-    batch["id"] = indices
-    return batch
+def add_external_ids(ds, urls, ids):
+    """This is done at the end of processing and we basically convert `external_urls` in `external_ids`"""
+    # Not all urls are part of our index. We keep `external_urls` for this sake.
+    if ds._indices is not None:
+        ds = ds.flatten_indices()
+    external_ids = lookup_external_ids(ds.data.column("external_urls"), urls, ids)
+    return ds.add_column("external_ids", external_ids)
+
+
+def lookup_external_ids(external_urls, urls, ids, max_lookup_size=10_000_000):
+    """Replace the external urls of each row by the ids of the urls found in `urls`.
+    The chunks of `external_urls` are looked up in groups of about `max_lookup_size`
+    external urls, so that the memory used by the lookup doesn't grow with the size
+    of the dataset. The result keeps the chunks of `external_urls`."""
+    external_urls = external_urls.cast(pa.list_(pa.large_string()))
+    chunks = []
+    group = []
+    group_size = 0
+    for chunk in external_urls.chunks:
+        group.append(chunk)
+        group_size += pc.sum(pc.list_value_length(chunk)).as_py() or 0
+        if group_size >= max_lookup_size:
+            chunks.extend(lookup_external_ids_of_chunks(group, urls, ids))
+            group = []
+            group_size = 0
+    if group:
+        chunks.extend(lookup_external_ids_of_chunks(group, urls, ids))
+    return pa.chunked_array(chunks, type=pa.list_(pa.int64()))
+
+
+def lookup_external_ids_of_chunks(chunks, urls, ids):
+    """The lookup is done at once on all the external urls of `chunks` with an Arrow
+    hash table, one `ListArray` of ids is returned per chunk."""
+    external_urls = pa.chunked_array(chunks, type=pa.list_(pa.large_string()))
+    lengths = pc.fill_null(pc.list_value_length(external_urls), 0).to_numpy()
+    positions = pc.index_in(pc.list_flatten(external_urls), value_set=urls)
+    is_found = pc.is_valid(positions).to_numpy(zero_copy_only=False)
+    found_ids = pc.take(ids, pc.drop_null(positions)).combine_chunks()
+    del positions
+
+    # The offsets of the external ids are the number of urls found before each row.
+    # The cumulative sums are written in place in arrays allocated with their final
+    # size, instead of being copied again to prepend the leading 0.
+    num_found = np.zeros(len(is_found) + 1, dtype=np.int64)
+    np.cumsum(is_found, dtype=np.int64, out=num_found[1:])
+    del is_found
+    url_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, dtype=np.int64, out=url_offsets[1:])
+    offsets = num_found[url_offsets]
+
+    id_chunks = []
+    start = 0
+    for chunk in chunks:
+        chunk_offsets = offsets[start : start + len(chunk) + 1]
+        id_chunks.append(
+            pa.ListArray.from_arrays(
+                pa.array(chunk_offsets - chunk_offsets[0], type=pa.int32()),
+                found_ids.slice(chunk_offsets[0], chunk_offsets[-1] - chunk_offsets[0]),
+            )
+        )
+        start += len(chunk)
+    return id_chunks
+
+
+def load_datasets(dataset_names):
+    """Download the datasets in parallel, they are returned in the same order"""
+    # Downloading is I/O bound, threads are enough
+    with ThreadPoolExecutor(max_workers=min(16, len(dataset_names))) as executor:
+        return list(
+            executor.map(
+                partial(load_dataset, use_auth_token=True, split="train"),
+                dataset_names,
+            )
+        )
 
 
 def main():
     args = get_args()
 
+    datasets = load_datasets(args.datasets_to_concatenate)
+
+    # Generate id
+    # The id is the position of the row in the concatenated dataset, it is added
+    # as a new column instead of rewriting all the columns with a map
+    offsets = np.cumsum([0] + [len(dataset) for dataset in datasets])
     datasets = [
-        load_dataset(dataset_name, use_auth_token=True, split="train")
-        for dataset_name in get_all_datasets_to_concatenate(args.flavor)
+        dataset.add_column("id", np.arange(offset, offset + len(dataset)))
+        for dataset, offset in zip(datasets, offsets)
+    ]
+
+    # Generate external_ids
+    # The latest rows of each dataset are merged, so that every dataset looks up
+    # the ids of all the datasets. The datasets are then concatenated only once.
+    latest_rows = [
+        select_latest_rows(dataset, num_proc=args.num_proc, batch_size=args.batch_size)
+        for dataset in datasets
     ]
+    urls, ids = get_url_ids(get_latest_rows(pa.concat_tables(latest_rows)))
+    del latest_rows
+    datasets = [add_external_ids(dataset, urls, ids) for dataset in datasets]
 
     # Concatenate all the splits together
     ds = concatenate_datasets(datasets)
 
-    # Generate id
-    ds = ds.map(assign_id, batched=True, with_indices=True)
-
-    # Generate external_ids
-    ds = compute_external_ids_(ds)
-
     # Add as train split
     ds.push_to_hub(args.dataset, private=True)
 